@@ -4,11 +4,15 @@ from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 from yfinance.exceptions import YFRateLimitError
 import yfinance as yf
+import numpy as np
 
 load_dotenv()
 TOKEN = (os.getenv("NOTION_TOKEN") or "").strip()
 DBID  = (os.getenv("NOTION_DATABASE_ID") or "").strip()
 ALPHA = (os.getenv("ALPHA_VANTAGE_KEY") or "").strip()
+SUMMARY_PAGE = (os.getenv("NOTION_SUMMARY_PAGE_ID") or "").strip()  # optional
+HISTORY_DIR = (os.getenv("PRICE_HISTORY_DIR") or ".price_history").strip()
+HISTORY_MAX_AGE = float(os.getenv("PRICE_HISTORY_MAX_AGE_HOURS") or 6) * 3600
 
 if not TOKEN:
     sys.exit("NOTION_TOKEN missing. Check your env/Secrets.")
@@ -30,39 +34,121 @@ META = get_db_meta()
 TITLE_PROP = next(k for k,v in META["properties"].items() if v["type"] == "title")
 HAS_CHANGE_COL = ("Change %" in META["properties"] and META["properties"]["Change %"]["type"] == "number")
 
+# ---------- local OHLCV history ----------
+# Append-only (bar for the last stored day may be rewritten): one raw column file per
+# field per ticker, e.g. .price_history/QQQ/close.f8.
+# Dates are int64 days since epoch; `date` is written last so a partial append is never read.
+FIELDS = ("open", "high", "low", "close", "volume")
+
+def _col_path(ticker: str, field: str) -> str:
+    ext = "i8" if field == "date" else "f8"
+    return os.path.join(HISTORY_DIR, ticker.upper(), f"{field}.{ext}")
+
+def _day_num(day) -> int:
+    return int(np.datetime64(day, "D").astype(np.int64))
+
+def history(ticker: str) -> dict:
+    """Memory-mapped columns for `ticker` (empty dict if nothing stored)."""
+    cols = {}
+    for field in ("date",) + FIELDS:
+        path = _col_path(ticker, field)
+        dtype = np.int64 if field == "date" else np.float64
+        n = os.path.getsize(path) // 8 if os.path.exists(path) else 0
+        if n == 0:
+            return {}
+        cols[field] = np.memmap(path, dtype=dtype, mode="r", shape=(n,))
+    n = len(cols["date"])
+    return {k: v[:n] for k, v in cols.items()}
+
+def append_bars(ticker: str, bars):
+    """Store (day, open, high, low, close, volume) bars from the last stored day on.
+
+    A bar dated the same as the last stored one overwrites it, so an intraday
+    close fetched during the session is corrected by later fetches.
+    """
+    os.makedirs(os.path.dirname(_col_path(ticker, "date")), exist_ok=True)
+    date_path = _col_path(ticker, "date")
+    n = os.path.getsize(date_path) // 8 if os.path.exists(date_path) else 0
+    for field in ("date",) + FIELDS:  # drop any tail left by an interrupted write
+        path = _col_path(ticker, field)
+        if os.path.exists(path) and os.path.getsize(path) != n * 8:
+            os.truncate(path, min(os.path.getsize(path), n * 8))
+    cols = history(ticker)
+    n = len(cols["date"]) if cols else 0
+    last = int(cols["date"][-1]) if cols else None
+    bars = sorted(bars, key=lambda b: b[0])
+    same = [b for b in bars if last is not None and _day_num(b[0]) == last][-1:]
+    new = [b for b in bars if last is None or _day_num(b[0]) > last]
+    if same:
+        for i, field in enumerate(FIELDS, start=1):
+            with open(_col_path(ticker, field), "r+b") as f:
+                f.seek((n - 1) * 8)
+                f.write(np.float64(same[0][i]).tobytes())
+    if new:
+        for i, field in enumerate(FIELDS, start=1):
+            with open(_col_path(ticker, field), "ab") as f:
+                f.write(np.array([b[i] for b in new], dtype=np.float64).tobytes())
+        with open(date_path, "ab") as f:
+            f.write(np.array([_day_num(b[0]) for b in new], dtype=np.int64).tobytes())
+    # mark the store as checked even when no new bar was published
+    with open(date_path, "ab"):
+        pass
+    os.utime(date_path)
+
+def is_fresh(ticker: str) -> bool:
+    path = _col_path(ticker, "date")
+    return os.path.exists(path) and time.time() - os.path.getmtime(path) < HISTORY_MAX_AGE
+
+def stored_last_quote(ticker: str):
+    """(close, previous close) of the newest stored bar, or None."""
+    cols = history(ticker)
+    if not cols:
+        return None
+    return float(cols["close"][-1]), (float(cols["close"][-2]) if len(cols["close"]) > 1 else None)
+
+def stored_prev_close(ticker: str, bar_day: str):
+    """Close of the stored bar before the one dated `bar_day`."""
+    cols = history(ticker)
+    if not cols:
+        return None
+    i = int(np.searchsorted(cols["date"], _day_num(bar_day), side="left"))
+    return float(cols["close"][i - 1]) if i > 0 else None
+
 # ---------- helpers ----------
 def is_crypto_usd_pair(ticker: str) -> bool:
     t = ticker.upper()
     return "-" in t and t.endswith("-USD")
 
 # Coinbase for crypto
-def price_from_coinbase(ticker: str, timeout=10) -> float:
+# Sources return (price, previous close); None when the source has no previous close.
+def price_from_coinbase(ticker: str, timeout=10) -> tuple:
     url = f"https://api.coinbase.com/v2/prices/{ticker.upper()}/spot"
     r = requests.get(url, timeout=timeout)
     r.raise_for_status()
-    return float(r.json()["data"]["amount"])
+    return float(r.json()["data"]["amount"]), None
 
 # Stooq for US stocks/ETFs
 def stooq_symbol(ticker: str) -> str:
     return f"{ticker.lower()}.us"
 
-def price_from_stooq(ticker: str, timeout=10) -> float:
+def price_from_stooq(ticker: str, timeout=10) -> tuple:
     url = f"https://stooq.com/q/d/l/?s={stooq_symbol(ticker)}&i=d"
     r = requests.get(url, timeout=timeout)
     r.raise_for_status()
     text = r.text.strip()
     if len(text.splitlines()) < 2:
         raise ValueError("No data from Stooq")
-    close = None
+    bars = []
     for row in csv.DictReader(io.StringIO(text)):
         if row.get("Close"):
-            close = row["Close"]
-    if close is None:
+            bars.append((row["Date"], *(float(row.get(k) or "nan") for k in ("Open", "High", "Low", "Close", "Volume"))))
+    if not bars:
         raise ValueError("No close in Stooq CSV")
-    return float(close)
+    append_bars(ticker, bars)
+    return bars[-1][4], stored_prev_close(ticker, bars[-1][0])
 
 # Alpha Vantage for equities (optional)
-def price_from_alpha_vantage(ticker: str, timeout=15) -> float:
+def price_from_alpha_vantage(ticker: str, timeout=15) -> tuple:
     if not ALPHA:
         raise RuntimeError("ALPHA_VANTAGE_KEY not set")
     url = "https://www.alphavantage.co/query"
@@ -70,21 +156,35 @@ def price_from_alpha_vantage(ticker: str, timeout=15) -> float:
     r = requests.get(url, params=params, timeout=timeout)
     r.raise_for_status()
     js = r.json()
-    price = js.get("Global Quote", {}).get("05. price")
+    quote = js.get("Global Quote", {})
+    price = quote.get("05. price")
     if not price:
         raise ValueError(f"AlphaVantage equity no data: {js}")
-    return float(price)
+    prev = quote.get("08. previous close")
+    return float(price), (float(prev) if prev else None)
 
 # Yahoo fallback with backoff
-def price_from_yahoo(ticker: str, max_tries=5) -> float:
+def price_from_yahoo(ticker: str, max_tries=5) -> tuple:
     wait = 1.0
     last_err = None
     for _ in range(max_tries):
         try:
-            hist = yf.Ticker(ticker).history(period="10d")
-            close = hist["Close"].dropna()
-            if not close.empty:
-                return float(round(close.iloc[-1], 4))
+            # full year on first fetch, then everything from the last stored bar on
+            # (re-fetching that bar lets append_bars replace an intraday close)
+            cols = history(ticker)
+            if cols:
+                since = str(np.datetime64(int(cols["date"][-1]), "D"))
+                hist = yf.Ticker(ticker).history(start=since)
+            else:
+                hist = yf.Ticker(ticker).history(period="1y")
+            hist = hist.dropna(subset=["Close"])
+            if not hist.empty:
+                bars = [
+                    (ts.date().isoformat(), *(float(round(r[k], 4)) for k in ("Open", "High", "Low", "Close")), float(r["Volume"]))
+                    for ts, r in hist.iterrows()
+                ]
+                append_bars(ticker, bars)
+                return bars[-1][4], stored_prev_close(ticker, bars[-1][0])
             last_err = ValueError("Empty Yahoo history")
         except Exception as e:
             last_err = e
@@ -92,15 +192,20 @@ def price_from_yahoo(ticker: str, max_tries=5) -> float:
         wait = min(wait * 2, 16)
     raise last_err or RuntimeError("Yahoo failed")
 
-def get_last_price(ticker: str) -> float:
+def get_quote(ticker: str) -> tuple:
+    """(last price, previous daily close) from the first source that answers."""
     if is_crypto_usd_pair(ticker):
-        # Crypto: Coinbase -> Yahoo
+        # Crypto: Coinbase -> Yahoo (Coinbase spot doesn't feed the store, so no store shortcut)
         try:
             return price_from_coinbase(ticker)
         except Exception:
             return price_from_yahoo(ticker)
     else:
-        # Equities/ETFs: Stooq -> Alpha (optional) -> Yahoo
+        # Equities/ETFs: store (if fresh) -> Stooq -> Alpha (optional) -> Yahoo
+        if is_fresh(ticker):
+            quote = stored_last_quote(ticker)
+            if quote is not None:
+                return quote
         try:
             return price_from_stooq(ticker)
         except Exception:
@@ -112,6 +217,9 @@ def get_last_price(ticker: str) -> float:
                 pass
         return price_from_yahoo(ticker)
 
+def get_last_price(ticker: str) -> float:
+    return get_quote(ticker)[0]
+
 # ---------- Notion helpers ----------
 def load_tickers():
     try:
@@ -151,8 +259,12 @@ def last_record_price_in_notion(ticker: str, before_day: str):
         return None
     return rows[0]["properties"]["Outcome"]["number"]
 
-def upsert_price(ticker: str, price: float, day: str):
-    prev = last_record_price_in_notion(ticker, day)
+def upsert_price(ticker: str, price: float, day: str, prev_close: float = None):
+    # Change % is the move since the previous daily close; sources without one
+    # (Coinbase spot) fall back to the previous daily Notion record
+    prev = prev_close
+    if prev is None:
+        prev = last_record_price_in_notion(ticker, day)
     change = None if prev in (None, 0) else (price/prev - 1.0)
 
     props = {
@@ -172,6 +284,78 @@ def upsert_price(ticker: str, price: float, day: str):
         r = requests.post("https://api.notion.com/v1/pages", headers=H, json={"parent": {"database_id": DBID}, "properties": props})
         print(f"CREATE {ticker} ->", r.status_code)
 
+# ---------- portfolio summary ----------
+def _num(props: dict, name: str):
+    p = props.get(name)
+    return p.get("number") if p and p.get("type") == "number" else None
+
+def load_positions():
+    """Every row with `Shares` as (ticker, props), read in one paginated query.
+
+    Each row is one lot, so a holding bought in several lots is summed,
+    like a rollup over the database would be.
+    """
+    q = {
+        "filter": {"property": "Shares", "number": {"is_not_empty": True}},
+        "page_size": 100
+    }
+    positions = []
+    while True:
+        r = requests.post(f"https://api.notion.com/v1/databases/{DBID}/query", headers=H, json=q)
+        r.raise_for_status()
+        js = r.json()
+        for row in js.get("results", []):
+            props = row["properties"]
+            title = "".join(t["plain_text"] for t in props[TITLE_PROP]["title"]).strip()
+            if title:
+                positions.append((title, props))
+        if not js.get("has_more"):
+            return positions
+        q["start_cursor"] = js["next_cursor"]
+
+def portfolio_summary(prices: dict, positions: list) -> dict:
+    # same math as the README formulas, done once over arrays instead of per row
+    lots = []
+    for t, props in positions:
+        px = prices.get(t)
+        if px is None:
+            px = _num(props, "Outcome")
+            if px is None:
+                print(f"Summary: no price for {t}, Market Value counted as 0")
+                px = 0.0
+            else:
+                print(f"Summary: {t} not fetched this run, using row Outcome {px}")
+        lots.append((t, props, px))
+    if not lots:
+        return {"Invested": 0.0, "Market Value": 0.0, "Unrealized P&L": 0.0, "Unrealized P&L %": 0.0, "Positions": 0}
+    cost   = np.array([_num(p, "Cost Basis") for _, p, _ in lots], dtype=float)  # None -> nan
+    shares = np.array([_num(p, "Shares") or 0.0 for _, p, _ in lots], dtype=float)
+    fees   = np.array([_num(p, "Fees") or 0.0 for _, p, _ in lots], dtype=float)
+    px     = np.array([x for _, _, x in lots], dtype=float)
+
+    # Invested is 0 (fees included) when Cost Basis is empty, as in the formula
+    invested = float(np.sum(np.where(np.isnan(cost), 0.0, cost * shares + fees)))
+    market   = float(np.sum(px * shares))
+    pnl = market - invested
+    return {
+        "Invested": round(invested, 2),
+        "Market Value": round(market, 2),
+        "Unrealized P&L": round(pnl, 2),
+        "Unrealized P&L %": 0.0 if invested == 0 else pnl / invested,
+        "Positions": len({t for t, _, _ in lots})
+    }
+
+def write_summary(summary: dict, day: str):
+    r = requests.get(f"https://api.notion.com/v1/pages/{SUMMARY_PAGE}", headers=H)
+    r.raise_for_status()
+    existing = r.json()["properties"]
+    props = {k: {"number": v} for k, v in summary.items()
+             if k in existing and existing[k]["type"] == "number"}
+    if "Date" in existing and existing["Date"]["type"] == "date":
+        props["Date"] = {"date": {"start": day}}
+    r = requests.patch(f"https://api.notion.com/v1/pages/{SUMMARY_PAGE}", headers=H, json={"properties": props})
+    print("SUMMARY ->", r.status_code)
+
 #if __name__ == "__main__":
 #    tickers = load_tickers()
 #    day = datetime.date.today().isoformat()
@@ -179,10 +363,17 @@ if __name__ == "__main__":
     tickers = load_tickers()
     # 用新加坡时区计算“今天”（GitHub Actions 是 UTC，避免日期偏移）
     day = datetime.datetime.now(ZoneInfo("Asia/Singapore")).date().isoformat()
+    prices = {}
     for t in tickers:
         try:
-            px = get_last_price(t)
-            upsert_price(t, px, day)
+            px, prev = get_quote(t)
+            prices[t] = px
+            upsert_price(t, px, day, prev)
             time.sleep(0.6 + random.uniform(0, 0.6))
         except Exception as e:
             print(f"Skip {t}: {e}")
+    if SUMMARY_PAGE:
+        try:
+            write_summary(portfolio_summary(prices, load_positions()), day)
+        except Exception as e:
+            print(f"Skip summary: {e}")